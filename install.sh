@@ -19,7 +19,7 @@ echo "Installing dependencies..."
 apt-get install -y git python3 python3-pip ffmpeg
 
 echo "Installing Python libraries..."
-pip3 install fastapi uvicorn --break-system-packages || pip3 install fastapi uvicorn
+pip3 install fastapi uvicorn orjson --break-system-packages || pip3 install fastapi uvicorn orjson
 
 # Stop service before updating to ensure clean state
 echo "Stopping existing service (if any)..."
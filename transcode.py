@@ -2,12 +2,18 @@ import os
 import subprocess
 import json
 import argparse
+import re
 import sys
-import threading
+import asyncio
 import time
 import logging
+import hashlib
+import socket
+import uuid
+from fractions import Fraction
+from pathlib import Path
 from fastapi import FastAPI, HTTPException, Response, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
@@ -17,40 +23,195 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Transcoding Server")
 
-# Global State
-CURRENT_JOB = None
-PREVIOUS_JOB = None
-JOB_LOCK = threading.Lock()
+# Global State; everything runs on uvicorn's event loop, so the lock
+# only needs to guard against interleaving across awaits. JOBS maps a
+# job id to its state dict for the job's whole life: queued ->
+# starting -> transcoding -> success/failed. Finished entries stay
+# around for /job/{id} lookups until pruned.
+JOBS = {}
+JOB_HISTORY_MAX = 100
+JOB_LOCK = asyncio.Lock()
+
+# Pending jobs; bounded so a runaway client gets 503 instead of an
+# ever-growing backlog.
+JOB_QUEUE = asyncio.Queue(maxsize=64)
+
+# Wakes /status/stream subscribers whenever progress or job state
+# changes, so they push updates instead of clients polling for them.
+PROGRESS_EVENT = asyncio.Event()
+
+def notify_status():
+    """Release all current stream subscribers; set() resolves their
+    waits immediately, so the clear() only rearms for the next batch."""
+    PROGRESS_EVENT.set()
+    PROGRESS_EVENT.clear()
+
+class ProgressCounters:
+    """
+    Hot per-job progress fields, updated and read without JOB_LOCK.
+    Single scalar assignments are atomic on the event loop, and a
+    slightly stale value is fine for a progress display; the lock is
+    reserved for job state transitions.
+    """
+    __slots__ = ('frames_processed', 'fps', 'total_frames')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames_processed = 0
+        self.fps = 0.0
+        self.total_frames = 0
 
 class TranscodeRequest(BaseModel):
     input: str
     output: str
+    exact_frames: bool = False
+
+# ffprobe output is parsed with orjson when available: it takes the
+# raw bytes directly and is several times faster on the deeply nested
+# streams array. The stdlib parser is a drop-in fallback.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# On-disk cache for ffprobe results; probing large files can take a
+# long time, so re-requests for unchanged files should skip it.
+PROBE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'transcoder', 'probe')
+
+# In-memory layer over the disk cache; repeat jobs within one server
+# run skip even the cache-file read. Oldest entries are evicted first.
+PROBE_MEMO = {}
+PROBE_MEMO_MAX = 128
+
+def memoize_probe(memo_key, data):
+    """Store a probe result in the in-memory layer, evicting the oldest."""
+    if memo_key is None:
+        return
+    while len(PROBE_MEMO) >= PROBE_MEMO_MAX:
+        PROBE_MEMO.pop(next(iter(PROBE_MEMO)))
+    PROBE_MEMO[memo_key] = data
+
+async def run_probe(input_path, mode, cmd):
+    """
+    Run an ffprobe command and return its parsed JSON output, cached
+    in memory and on disk keyed by the file's path, size, mtime and the
+    probe mode. The subprocess runs on the event loop; no worker thread.
+    """
+    cache_path = None
+    memo_key = None
+    try:
+        st = os.stat(input_path)
+        key = f"{os.path.abspath(input_path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{mode}"
+        memo_key = key
+        if key in PROBE_MEMO:
+            return PROBE_MEMO[key]
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        cache_path = os.path.join(PROBE_CACHE_DIR, f"{digest}.json")
+    except OSError:
+        pass
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                data = json_loads(f.read())
+            logger.info(f"Probe cache hit for {input_path} ({mode})")
+            memoize_probe(memo_key, data)
+            return data
+        except (OSError, ValueError):
+            pass  # corrupt or unreadable cache entry; reprobe
+
+    # Binary output; the JSON parser handles the decode itself, so
+    # ffprobe's stdout never takes a detour through a TextIOWrapper
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    data = json_loads(stdout)
+
+    if cache_path:
+        try:
+            os.makedirs(PROBE_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write probe cache: {e}")
+
+    memoize_probe(memo_key, data)
+    return data
+
+async def probe_media(input_path):
+    """
+    Probe a file once for everything a job needs: the stream layout for
+    audio/subtitle selection plus the duration/frame-rate metadata used
+    for progress tracking.
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-threads', '1',  # metadata-only read; no use spinning up decoders
+        '-print_format', 'json',
+        '-show_entries',
+        'stream=index,codec_type,codec_name,r_frame_rate,duration,nb_frames'
+        ':stream_tags=language:format=duration',
+        input_path
+    ]
+    return await run_probe(input_path, 'media', cmd)
 
-def get_video_duration_frames(input_path):
+async def count_frames_exact(input_path):
     """
-    Attempts to get the total number of frames in the video stream.
-    Returns (duration_seconds, total_frames).
+    Count the frames of the first video stream by decoding the whole
+    file. O(filesize), so only used when a client opts in via
+    exact_frames; the metadata-based estimate is the default.
     """
     cmd = [
-        'ffprobe', 
-        '-v', 'error', 
-        '-select_streams', 'v:0', 
-        '-show_entries', 'stream=r_frame_rate,duration,nb_frames', 
-        '-of', 'json', 
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-count_frames',
+        '-show_entries', 'stream=nb_read_frames',
+        '-of', 'json',
         input_path
     ]
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
+        data = await run_probe(input_path, 'count', cmd)
         streams = data.get('streams', [])
-        if not streams:
+        if streams:
+            return int(streams[0].get('nb_read_frames', 0))
+    except Exception as e:
+        logger.error(f"Error counting frames: {e}")
+    return 0
+
+# The handful of r_frame_rate values real files actually carry,
+# pre-built as exact Fractions so the common case skips parsing.
+_COMMON_RATES = {rate: Fraction(rate) for rate in (
+    '24000/1001', '30000/1001', '60000/1001',
+    '24/1', '25/1', '30/1', '50/1', '60/1')}
+
+def get_video_duration_frames(media_info):
+    """
+    Attempts to get the total number of frames in the video stream from
+    already-probed media info. Returns (duration_seconds, total_frames).
+    """
+    try:
+        streams = media_info.get('streams', [])
+        video_streams = [s for s in streams if s.get('codec_type') == 'video']
+        if not video_streams:
             logger.warning("No video streams found")
             return 0, 0
-            
-        stream = streams[0]
-        
-        # Get duration
-        duration = stream.get('duration')
+
+        stream = video_streams[0]
+
+        # Get duration; some containers (e.g. MKV) only record it at the
+        # format level, not per stream
+        duration = stream.get('duration') or media_info.get('format', {}).get('duration')
         if duration:
             try:
                 duration_sec = float(duration)
@@ -69,288 +230,631 @@ def get_video_duration_frames(input_path):
             except ValueError:
                 pass
 
-        # Calculate from duration * fps if not available
+        # Calculate from duration * fps if not available. Exact
+        # rational arithmetic: 23.976 fps is really 24000/1001, and
+        # float rounding drifts by dozens of frames over a
+        # feature-length file
         if total_frames == 0 and duration_sec > 0:
             r_frame_rate = stream.get('r_frame_rate', '')
-            if '/' in r_frame_rate:
+            fps = _COMMON_RATES.get(r_frame_rate)
+            if fps is None and '/' in r_frame_rate:
+                num, _, den = r_frame_rate.partition('/')
                 try:
-                    num, den = map(int, r_frame_rate.split('/'))
-                    if den > 0:
-                        fps = num / den
-                        total_frames = int(duration_sec * fps)
-                        logger.info(f"Frame count calculated: {total_frames} (duration: {duration_sec}s, fps: {fps})")
-                except ValueError:
+                    fps = Fraction(int(num), int(den))
+                except (ValueError, ZeroDivisionError):
                     logger.warning("Could not parse frame rate")
-            
+            if fps:
+                try:
+                    total_frames = int(Fraction(duration) * fps)
+                    logger.info(f"Frame count calculated: {total_frames} (duration: {duration_sec}s, fps: {float(fps)})")
+                except ValueError:
+                    logger.warning("Could not parse duration")
+
+
         return duration_sec, total_frames
         
     except Exception as e:
         logger.error(f"Error probing for frame count: {e}")
         return 0, 0
 
-def stderr_reader(process):
-    """Read stderr in a separate thread to prevent blocking."""
+# Per-job ffmpeg stderr logs land here; clean-up/rotation is left to
+# logrotate or the operator.
+LOG_DIR = os.environ.get('TRANSCODE_LOG_DIR', '/var/log/transcode')
+
+# How much of the end of the stderr log gets attached to a failure.
+STDERR_TAIL_LIMIT = 64 * 1024
+
+# The only keys we track from ffmpeg's -progress output; the regex
+# skips the other ~10 per block (bitrate, out_time, speed, ...) without
+# ever decoding them.
+PROGRESS_RE = re.compile(rb'^(frame|fps)=(\S+)', re.M)
+
+# Matched keys map to the counter attribute and converter to apply on
+# the running job's ProgressCounters; adding a tracked key means one
+# regex alternative and one entry here.
+PROGRESS_HANDLERS = {
+    b'frame': ('frames_processed', int),
+    b'fps': ('fps', float)
+}
+
+# FFmpeg command fragments that are identical for every job, built once
+# at import; per-job assembly is then just tuple concatenation around
+# the input/output paths and stream maps.
+# -y only ever applies to the fresh .part path ffmpeg writes to; the
+# refusal to overwrite an existing output is enforced on the final
+# path before the job starts.
+FFMPEG_HEAD = ('ffmpeg', '-y')
+FFMPEG_COMMON = (
+    '-map_metadata', '0',
+    '-map', '0:v:0',
+    '-nostats'  # Reduce verbosity; progress goes to a per-job unix socket
+)
+def physical_core_count():
+    """
+    Count the physical cores available to this process, discounting SMT
+    siblings; x265 sizes its pools from logical cores, which
+    oversubscribes on hyperthreaded systems.
+    """
+    try:
+        available = os.sched_getaffinity(0)
+    except AttributeError:
+        return os.cpu_count() or 1
+
+    cores = set()
+    for cpu in available:
+        path = f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list'
+        try:
+            with open(path) as f:
+                cores.add(f.read().strip())
+        except OSError:
+            cores.add(str(cpu))
+    return max(1, len(cores))
+
+# Encoder tuning; overridable via environment without code changes.
+X265_PRESET = os.environ.get('X265_PRESET', 'medium')
+X265_CRF = os.environ.get('X265_CRF', '22')
+X265_POOL = os.environ.get('X265_POOL', str(physical_core_count()))
+
+# Concurrent encodes: each job's x265 pool is capped, so a many-core
+# box can run as many jobs as capped pools fit. With the default pool
+# spanning all physical cores that is exactly one, i.e. serial.
+try:
+    # Only a positive pool size caps a job; 0 (no pools) or negative
+    # values leave the encode spanning the machine, so run one job
+    _pool = int(X265_POOL)
+    _pool_fit = max(1, physical_core_count() // _pool) if _pool > 0 else 1
+except ValueError:  # X265_POOL can use x265's non-numeric pool syntax
+    _pool_fit = 1
+WORKER_COUNT = int(os.environ.get('TRANSCODE_WORKERS', _pool_fit))
+
+FFMPEG_VIDEO_SW = (
+    '-c:v', 'libx265',
+    '-preset', X265_PRESET,
+    '-crf', X265_CRF,
+    '-x265-params', f'pools={X265_POOL}',
+    '-tag:v', 'hvc1',
+    '-pix_fmt', 'yuv420p10le',
+    '-vf', 'scale=-2:1080'
+)
+FFMPEG_AUDIO = (
+    '-c:a', 'aac',
+    '-b:a', '192k',
+    '-ac', '2'
+)
+
+# Hardware HEVC encoders in preference order: the input-side
+# acceleration options and the video-encode options for each. CPU
+# libx265 remains the fallback when none is available.
+HW_ENCODERS = {
+    'hevc_nvenc': {
+        'input': ('-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda'),
+        # Frames stay on the GPU end to end, so the 10-bit format is
+        # requested inside scale_cuda; a -pix_fmt here would force a
+        # software conversion that can't accept CUDA hw frames
+        'video': ('-c:v', 'hevc_nvenc', '-preset', 'p6', '-rc', 'vbr', '-cq', '23',
+                  '-profile:v', 'main10', '-tag:v', 'hvc1',
+                  '-vf', 'scale_cuda=-2:1080:format=p010le')
+    },
+    'hevc_qsv': {
+        'input': (),
+        'video': ('-c:v', 'hevc_qsv', '-preset', 'medium', '-global_quality', '23',
+                  '-profile:v', 'main10', '-pix_fmt', 'p010le', '-tag:v', 'hvc1',
+                  '-vf', 'scale=-2:1080')
+    },
+    'hevc_vaapi': {
+        'input': ('-vaapi_device', '/dev/dri/renderD128'),
+        'video': ('-c:v', 'hevc_vaapi', '-qp', '23',
+                  '-profile:v', 'main10', '-tag:v', 'hvc1',
+                  '-vf', 'scale=-2:1080,format=p010,hwupload')
+    },
+    'hevc_videotoolbox': {
+        'input': (),
+        'video': ('-c:v', 'hevc_videotoolbox', '-q:v', '55',
+                  '-profile:v', 'main10', '-pix_fmt', 'p010le', '-tag:v', 'hvc1',
+                  '-vf', 'scale=-2:1080')
+    }
+}
+
+_ENCODER_ARGS = None
+
+def detect_hw_encoder():
+    """
+    Pick the best available HEVC encoder, checking ffmpeg's encoder list
+    once per process. Returns (input_args, video_args) tuples; falls
+    back to libx265 when no hardware encoder is present. An ENCODER
+    environment variable skips detection and forces a specific encoder.
+    """
+    global _ENCODER_ARGS
+    if _ENCODER_ARGS is not None:
+        return _ENCODER_ARGS
+
+    _ENCODER_ARGS = ((), FFMPEG_VIDEO_SW)
+
+    override = os.environ.get('ENCODER')
+    if override:
+        if override in HW_ENCODERS:
+            logger.info(f"Using HEVC encoder from ENCODER override: {override}")
+            _ENCODER_ARGS = (HW_ENCODERS[override]['input'], HW_ENCODERS[override]['video'])
+        else:
+            if override != 'libx265':
+                logger.warning(f"Unknown ENCODER '{override}', using libx265")
+        return _ENCODER_ARGS
+
     try:
-        for line in process.stderr:
-            if line:
-                logger.warning(f"FFmpeg: {line.rstrip()}")
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, check=True)
+        for name, args in HW_ENCODERS.items():
+            if name in result.stdout:
+                logger.info(f"Using hardware HEVC encoder: {name}")
+                _ENCODER_ARGS = (args['input'], args['video'])
+                break
+        else:
+            logger.info("No hardware HEVC encoder found, using libx265")
     except Exception as e:
-        logger.error(f"Error reading stderr: {e}")
+        logger.warning(f"Encoder detection failed, using libx265: {e}")
 
-def run_transcode(input_path, output_path):
-    global CURRENT_JOB, PREVIOUS_JOB
-    
-    logger.info(f"Starting transcode job: {input_path} -> {output_path}")
-    
-    # Update status to starting
-    with JOB_LOCK:
-        if CURRENT_JOB:
-            CURRENT_JOB['status'] = 'analyzing'
-        
+    return _ENCODER_ARGS
+
+# The capability set is immutable for the process lifetime; resolve it
+# at import so job setup is a pair of constant lookups.
+ENCODER_INPUT_ARGS, ENCODER_VIDEO_ARGS = detect_hw_encoder()
+
+def deprioritize(pid):
+    """
+    Nice the ffmpeg child and keep one core free so the web server
+    stays responsive while an encode saturates the CPU.
+    """
     try:
-        # 0. Enforce MKV extension
-        base, ext = os.path.splitext(output_path)
-        if ext.lower() != '.mkv':
-            output_path = base + '.mkv'
+        os.setpriority(os.PRIO_PROCESS, pid, 10)
+        cores = os.cpu_count() or 1
+        if cores > 1 and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(pid, set(range(cores - 1)))
+    except OSError as e:
+        logger.warning(f"Could not deprioritize FFmpeg (PID {pid}): {e}")
+
+def read_stderr_tail(stderr_log):
+    """Read the last chunk of a job's stderr log for error reporting."""
+    try:
+        with open(stderr_log, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - STDERR_TAIL_LIMIT))
+            return f.read().decode('utf-8', errors='replace')
+    except OSError as e:
+        return f"<could not read stderr log {stderr_log}: {e}>"
+
+async def run_transcode(job):
+    job_id = job['id']
+    input_path = job['input']
+    output_path = job['output']
+    exact_frames = job['exact_frames']
+    progress = job['progress']
+
+    logger.info(f"Starting transcode job {job_id}: {input_path} -> {output_path}")
+
+    input_fd = -1
+    progress_srv = None
+    progress_conn = None
+    sock_path = None
+    tmp_path = None
+    try:
+        # One Path each; suffix/parent/stat below reuse these instead
+        # of repeated os.path calls over the same strings
+        in_p = Path(input_path)
+        out_p = Path(output_path)
+
+        # 0. Enforce MKV extension; the corrected path is published to
+        # the job entry together with the status change below
+        if out_p.suffix.lower() != '.mkv':
+            out_p = out_p.with_suffix('.mkv')
+            output_path = str(out_p)
             logger.info(f"Enforcing MKV container. Output file changed to: {output_path}")
-            with JOB_LOCK:
-                if CURRENT_JOB:
-                    CURRENT_JOB['output'] = output_path
 
-        # 1. Validation
-        if not os.path.exists(input_path):
+        if out_p.exists():
+            raise FileExistsError(f"Output file already exists: {output_path}")
+
+        # FFmpeg writes to a .part file that only becomes the real
+        # output via an atomic rename after a clean exit, so a failed or
+        # killed job never leaves a half-written MKV behind
+        tmp_path = output_path + '.part'
+
+        # 1. Validation; a single stat both checks existence and gives
+        # us the size/mtime the probe cache keys on
+        try:
+            in_p.stat()
+        except FileNotFoundError:
             raise FileNotFoundError(f"Input file not found: {input_path}")
 
         logger.info(f"Input file validated: {input_path}")
 
-        # 1b. Ensure output directory exists
-        output_dir = os.path.dirname(output_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            logger.info(f"Created output directory: {output_dir}")
-
-        # Get total frames for progress
-        logger.info("Probing video for frame count...")
-        _, total_frames = get_video_duration_frames(input_path)
-        with JOB_LOCK:
-            if CURRENT_JOB:
-                CURRENT_JOB['total_frames'] = total_frames
-        logger.info(f"Total frames: {total_frames}")
+        # 1b. Ensure output directory exists; one call, no pre-check
+        out_p.parent.mkdir(parents=True, exist_ok=True)
 
-        # 2. Probe the file using ffprobe (original logic)
+        # 2. Probe the file once for stream layout and frame-count
+        # metadata
         logger.info("Analyzing video streams...")
-        probe_cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', input_path]
-        result = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
-        media_info = json.loads(result.stdout)
+        media_info = await probe_media(input_path)
 
-        # 3. Identify Audio Streams
-        streams = media_info.get('streams', [])
-        audio_streams = [s for s in streams if s['codec_type'] == 'audio']
-        
-        english_audio_index = None
+        # Get total frames for progress from the same probe result
+        _, total_frames = get_video_duration_frames(media_info)
+
+        # Only decode-scan the file when the client asked for an exact
+        # count; the metadata estimate is good enough for a progress bar
+        if exact_frames:
+            logger.info("Counting frames exactly (exact_frames requested)...")
+            counted = await count_frames_exact(input_path)
+            if counted:
+                total_frames = counted
 
-        if audio_streams:
-            for stream in audio_streams:
-                tags = stream.get('tags', {})
-                lang = tags.get('language', '').lower()
-                if lang in ['eng', 'en', 'english']:
-                    english_audio_index = stream['index']
-                    break
-
-        # 4. Construct FFmpeg Command
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-n',
-            '-i', input_path,
-            '-map_metadata', '0',
-            '-map', '0:v:0',
-            '-progress', '-',  # Output progress to stdout
-            '-nostats'         # Reduce verbosity
-        ]
+        progress.total_frames = total_frames
+        logger.info(f"Total frames: {total_frames}")
 
+        # 3. Classify streams in a single pass
+        english_audio_index = None
+        has_audio = False
+        has_subtitles = False
+        needs_srt_conversion = False
+
+        for stream in media_info.get('streams', ()):
+            codec_type = stream.get('codec_type')
+            if codec_type == 'audio':
+                has_audio = True
+                if english_audio_index is None:
+                    lang = stream.get('tags', {}).get('language', '').lower()
+                    if lang in ('eng', 'en', 'english'):
+                        english_audio_index = stream['index']
+            elif codec_type == 'subtitle':
+                has_subtitles = True
+                if stream.get('codec_name') == 'mov_text':
+                    needs_srt_conversion = True
+
+        # 4. Construct FFmpeg Command; only the stream maps vary per job
+        map_args = ()
         if english_audio_index is not None:
-            ffmpeg_cmd.extend(['-map', f'0:{english_audio_index}'])
-        elif audio_streams:
-            ffmpeg_cmd.extend(['-map', '0:a'])
-
-        subtitle_streams = [s for s in streams if s['codec_type'] == 'subtitle']
-        if subtitle_streams:
-            needs_conversion = any(s.get('codec_name') == 'mov_text' for s in subtitle_streams)
-            if needs_conversion:
-                ffmpeg_cmd.extend(['-map', '0:s', '-c:s', 'srt'])
+            map_args += ('-map', f'0:{english_audio_index}')
+        elif has_audio:
+            map_args += ('-map', '0:a')
+
+        if has_subtitles:
+            if needs_srt_conversion:
+                map_args += ('-map', '0:s', '-c:s', 'srt')
             else:
-                ffmpeg_cmd.extend(['-map', '0:s', '-c:s', 'copy'])
-
-        ffmpeg_cmd.extend([
-            '-c:v', 'libx265',
-            '-preset', 'medium',
-            '-tag:v', 'hvc1',
-            '-pix_fmt', 'yuv420p10le',
-            '-vf', 'scale=-2:1080',
-            '-c:a', 'aac',
-            '-b:a', '192k',
-            '-ac', '2',
-            output_path
-        ])
+                map_args += ('-map', '0:s', '-c:s', 'copy')
+
+        # Open the input ourselves so the kernel gets a sequential-read
+        # hint, and hand ffmpeg the advised descriptor via /dev/fd
+        input_arg = input_path
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                input_fd = os.open(input_path, os.O_RDONLY | os.O_CLOEXEC)
+                os.posix_fadvise(input_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                input_arg = f'/dev/fd/{input_fd}'
+            except OSError as e:
+                logger.warning(f"Could not apply fadvise hints: {e}")
+                if input_fd >= 0:
+                    os.close(input_fd)
+                    input_fd = -1
+
+        # Progress goes over a dedicated unix socket instead of stdout:
+        # updates arrive batched every 2s and never compete with
+        # ffmpeg's other output for pipe space. Named by job id so
+        # concurrent jobs never share a socket.
+        sock_path = f"/tmp/transcode-progress-{job_id}.sock"
+        try:
+            os.unlink(sock_path)
+        except FileNotFoundError:
+            pass
+        progress_srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        progress_srv.bind(sock_path)
+        progress_srv.listen(1)
+        progress_srv.setblocking(False)
+        progress_args = ('-progress', f'unix://{sock_path}', '-stats_period', '2')
+
+        ffmpeg_cmd = (*FFMPEG_HEAD, *ENCODER_INPUT_ARGS, '-i', input_arg, *FFMPEG_COMMON,
+                      *progress_args, *map_args, *ENCODER_VIDEO_ARGS, *FFMPEG_AUDIO,
+                      '-f', 'matroska',  # don't re-sniff from the .part name
+                      tmp_path)
 
         logger.info(f"Starting FFmpeg transcode: {input_path} -> {output_path}")
         logger.info(f"FFmpeg command: {' '.join(ffmpeg_cmd)}")
         
-        # Start FFmpeg process
-        with JOB_LOCK:
-            if CURRENT_JOB:
-                CURRENT_JOB['status'] = 'transcoding'
-        
+        # Publish all setup-phase updates in one critical section right
+        # before the encode starts
+        async with JOB_LOCK:
+            job.update({
+                'output': output_path,
+                'status': 'transcoding'
+            })
+        notify_status()
+
+        # FFmpeg stderr goes straight to a per-job log file: the kernel
+        # handles the buffering and the chatty x265 output never touches
+        # Python. On failure the tail is read back from the file.
+        stderr_log = None
+        stderr_dest = asyncio.subprocess.DEVNULL
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            stderr_log = os.path.join(
+                LOG_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{job_id}.stderr.log")
+            stderr_file = open(stderr_log, 'ab')
+            stderr_dest = stderr_file
+        except OSError as e:
+            logger.warning(f"Could not open stderr log in {LOG_DIR}: {e}")
+            stderr_log = None
+
         logger.info("Launching FFmpeg process...")
-        process = subprocess.Popen(
-            ffmpeg_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-        
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=stderr_dest,
+                pass_fds=(input_fd,) if input_fd >= 0 else ()
+            )
+        finally:
+            # The child owns its duplicate of the log fd now
+            if stderr_dest is not asyncio.subprocess.DEVNULL:
+                stderr_dest.close()
+
         logger.info(f"FFmpeg process started (PID: {process.pid})")
+        deprioritize(process.pid)
 
-        # Start stderr reader thread to prevent blocking
-        stderr_thread = threading.Thread(target=stderr_reader, args=(process,))
-        stderr_thread.daemon = True
-        stderr_thread.start()
+        # Wait for ffmpeg to connect to the progress socket; if it dies
+        # first (bad arguments, unsupported protocol) the returncode
+        # check breaks us out
+        loop = asyncio.get_running_loop()
+        while progress_conn is None and process.returncode is None:
+            try:
+                progress_conn, _ = await asyncio.wait_for(
+                    loop.sock_accept(progress_srv), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
 
-        # Read progress from stdout (because of -progress -)
-        while True:
-            line = process.stdout.readline()
-            if not line:
+        # Read progress updates and extract the tracked keys with one
+        # compiled-regex pass over the raw bytes; int() and float()
+        # accept ASCII bytes directly, so nothing else in the progress
+        # block is ever decoded.
+        buffer = b''
+        while progress_conn is not None:
+            chunk = await loop.sock_recv(progress_conn, 65536)
+            if not chunk:
                 break
-            
-            line = line.strip()
-            if not line:
+
+            buffer += chunk
+            end = buffer.rfind(b'\n')
+            if end < 0:
                 continue
+            complete, buffer = buffer[:end + 1], buffer[end + 1:]
+
+            for key, value in PROGRESS_RE.findall(complete):
+                attr, convert = PROGRESS_HANDLERS[key]
+                try:
+                    setattr(progress, attr, convert(value))
+                except ValueError:
+                    pass
+            notify_status()
 
-            # Parse key=value lines
-            if '=' in line:
-                key, value = line.split('=', 1)
-                key = key.strip()
-                value = value.strip()
-                
-                with JOB_LOCK:
-                    if CURRENT_JOB:
-                        if key == 'frame':
-                            try:
-                                CURRENT_JOB['frames_processed'] = int(value)
-                            except ValueError:
-                                pass
-                        elif key == 'fps':
-                            try:
-                                CURRENT_JOB['fps'] = float(value)
-                            except ValueError:
-                                pass
-                        elif key == 'progress':
-                            if value == 'end':
-                                break
-
-        process.wait()
+        await process.wait()
         logger.info(f"FFmpeg process completed with return code: {process.returncode}")
-        
+
         if process.returncode != 0:
-            # stderr already consumed by stderr_thread, so just raise the error
-            raise subprocess.CalledProcessError(process.returncode, ffmpeg_cmd)
+            tail = read_stderr_tail(stderr_log) if stderr_log else ''
+            logger.error(f"FFmpeg stderr tail:\n{tail}")
+            raise subprocess.CalledProcessError(process.returncode, ffmpeg_cmd, stderr=tail)
 
-        # Success
-        with JOB_LOCK:
-            PREVIOUS_JOB = {
-                'input': input_path,
-                'output': output_path,
+        # Success; promote the finished .part file atomically
+        os.replace(tmp_path, output_path)
+
+        async with JOB_LOCK:
+            job.update({
                 'status': 'success',
                 'timestamp': time.time()
-            }
-            CURRENT_JOB = None
-            
+            })
+        notify_status()
+
         logger.info(f"Transcoding completed successfully: {output_path}")
 
     except Exception as e:
         logger.error(f"Transcoding failed: {e}", exc_info=True)
-        with JOB_LOCK:
-            PREVIOUS_JOB = {
-                'input': input_path,
-                'output': output_path,
+        # CalledProcessError carries the stderr tail; surface it in the
+        # job entry so /job/{id} and /previous report the actual cause
+        error = str(e)
+        stderr_tail = getattr(e, 'stderr', None)
+        if stderr_tail:
+            error = f"{error}\n{stderr_tail}"
+        async with JOB_LOCK:
+            job.update({
                 'status': 'failed',
-                'error': str(e),
+                'error': error,
                 'timestamp': time.time()
-            }
-            CURRENT_JOB = None
+            })
+        notify_status()
 
-def start_job(input_path: str, output_path: str):
-    global CURRENT_JOB
-    
+    finally:
+        # A .part file still present here belongs to a failed job
+        if tmp_path is not None and os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except OSError as e:
+                logger.warning(f"Could not remove partial output {tmp_path}: {e}")
+        if progress_conn is not None:
+            progress_conn.close()
+        if progress_srv is not None:
+            progress_srv.close()
+        if sock_path is not None:
+            try:
+                os.unlink(sock_path)
+            except OSError:
+                pass
+        if input_fd >= 0:
+            # A multi-GB encode shouldn't evict the rest of the page
+            # cache; drop the input's pages now that we're done with them
+            try:
+                os.posix_fadvise(input_fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+            os.close(input_fd)
+
+def prune_jobs():
+    """Drop the oldest finished jobs once JOBS outgrows its history cap."""
+    excess = len(JOBS) - JOB_HISTORY_MAX
+    if excess <= 0:
+        return
+    finished = [job_id for job_id, job in JOBS.items()
+                if job['status'] in ('success', 'failed')]
+    for job_id in finished[:excess]:
+        del JOBS[job_id]
+
+def job_snapshot(job):
+    """Public view of a job entry, progress counters flattened in."""
+    progress = job['progress']
+    snapshot = {
+        'id': job['id'],
+        'input': job['input'],
+        'output': job['output'],
+        'status': job['status'],
+        'fps': progress.fps,
+        'frames_processed': progress.frames_processed,
+        'total_frames': progress.total_frames
+    }
+    for key in ('error', 'timestamp'):
+        if key in job:
+            snapshot[key] = job[key]
+    return snapshot
+
+async def job_worker():
+    """Consume queued jobs for the lifetime of the server; WORKER_COUNT
+    of these run concurrently, each encoding one file at a time."""
+    while True:
+        job = await JOB_QUEUE.get()
+        async with JOB_LOCK:
+            job['status'] = 'starting'
+        notify_status()
+        await run_transcode(job)
+        async with JOB_LOCK:
+            prune_jobs()
+        JOB_QUEUE.task_done()
+
+@app.on_event("startup")
+async def start_workers():
+    # Keep references so the worker tasks are not garbage collected
+    app.state.workers = [asyncio.create_task(job_worker())
+                         for _ in range(WORKER_COUNT)]
+    logger.info(f"Started {WORKER_COUNT} transcode worker(s)")
+
+async def start_job(input_path: str, output_path: str, exact_frames: bool = False):
     # Strip quotes if present
     input_path = input_path.strip("'").strip('"')
     output_path = output_path.strip("'").strip('"')
 
     if not input_path or not output_path:
         raise HTTPException(status_code=400, detail="Missing input or output parameters")
-        
-    # Validation check before starting thread to give immediate feedback
+
+    # Validation check before queueing to give immediate feedback
     if not os.path.exists(input_path):
         raise HTTPException(status_code=400, detail=f"Input file not found: {input_path}")
 
-    with JOB_LOCK:
-        if CURRENT_JOB is not None:
-            raise HTTPException(status_code=409, detail="Server is busy with another transcoding request")
-        
-        # Initialize job
-        CURRENT_JOB = {
-            'input': input_path,
-            'output': output_path,
-            'status': 'starting',
-            'fps': 0.0,
-            'frames_processed': 0,
-            'total_frames': 0
-        }
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'input': input_path,
+        'output': output_path,
+        'exact_frames': exact_frames,
+        'status': 'queued',
+        'progress': ProgressCounters()
+    }
 
-    # Start thread
-    thread = threading.Thread(target=run_transcode, args=(input_path, output_path))
-    thread.daemon = True
-    thread.start()
+    try:
+        JOB_QUEUE.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Transcoding queue is full")
+    JOBS[job_id] = job
 
-    return {"message": "Transcoding started"}
+    return {"message": "Transcoding queued", "job_id": job_id,
+            "position": JOB_QUEUE.qsize()}
 
 @app.get("/transcode", status_code=status.HTTP_202_ACCEPTED)
-def start_transcode_get(input: str, output: str):
-    return start_job(input, output)
+async def start_transcode_get(input: str, output: str, exact_frames: bool = False):
+    return await start_job(input, output, exact_frames)
 
 @app.post("/transcode", status_code=status.HTTP_202_ACCEPTED)
-def start_transcode_post(request: TranscodeRequest):
-    return start_job(request.input, request.output)
+async def start_transcode_post(request: TranscodeRequest):
+    return await start_job(request.input, request.output, request.exact_frames)
+
+@app.get("/job/{job_id}")
+async def get_job(job_id: str):
+    # Read-only snapshot; no awaits between reads, so no lock needed
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No such job: {job_id}")
+    return job_snapshot(job)
+
+def status_snapshot():
+    # Read-only snapshot; no awaits between reads, so no lock needed.
+    # With several workers this reports all running jobs; the top-level
+    # fields mirror the first one for older clients.
+    running = [job for job in JOBS.values()
+               if job['status'] in ('starting', 'transcoding')]
+    if running:
+        response = job_snapshot(running[0])
+        response['busy'] = True
+        response['queued'] = JOB_QUEUE.qsize()
+        response['jobs'] = [job_snapshot(job) for job in running]
+        return response
+    else:
+        return {
+            'busy': False,
+            'status': 'idle',
+            'queued': JOB_QUEUE.qsize()
+        }
 
 @app.get("/status")
-def get_status():
-    with JOB_LOCK:
-        if CURRENT_JOB:
-            return {
-                'busy': True,
-                'input': CURRENT_JOB['input'],
-                'output': CURRENT_JOB['output'],
-                'fps': CURRENT_JOB['fps'],
-                'frames_processed': CURRENT_JOB['frames_processed'],
-                'total_frames': CURRENT_JOB['total_frames'],
-                'status': CURRENT_JOB['status']
-            }
-        else:
-            return {
-                'busy': False,
-                'status': 'idle'
-            }
+async def get_status():
+    return status_snapshot()
+
+@app.get("/status/stream")
+async def stream_status():
+    # Push-based alternative to polling /status: one event per progress
+    # batch or job state change, plus an idle heartbeat so proxies
+    # don't time the stream out.
+    async def events():
+        while True:
+            yield f"data: {json.dumps(status_snapshot())}\n\n"
+            try:
+                await asyncio.wait_for(PROGRESS_EVENT.wait(), timeout=15.0)
+            except asyncio.TimeoutError:
+                pass
+
+    return StreamingResponse(events(), media_type='text/event-stream')
 
 @app.get("/previous")
-def get_previous():
-    with JOB_LOCK:
-        if PREVIOUS_JOB:
-            return PREVIOUS_JOB
-        else:
-            return {
-                'status': 'none',
-                'message': 'No previous jobs recorded'
-            }
+async def get_previous():
+    for job in reversed(JOBS.values()):
+        if job['status'] in ('success', 'failed'):
+            return job_snapshot(job)
+    return {
+        'status': 'none',
+        'message': 'No previous jobs recorded'
+    }
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Transcoding FastAPI Server")